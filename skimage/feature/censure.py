@@ -1,8 +1,14 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 import numpy as np
-from scipy.ndimage import maximum_filter, minimum_filter, convolve
+from scipy.ndimage import (maximum_filter1d, minimum_filter1d, convolve,
+                           gaussian_filter)
+from scipy.signal import fftconvolve
 
 from ..transform import integral_image
-from ..feature import structure_tensor
+from ..feature.corner import _compute_derivatives
 from ..morphology import octagon, star
 from ..feature.censure_cy import _censure_dob_loop
 from ..feature.util import (FeatureDetector, _prepare_grayscale_input_2D,
@@ -25,22 +31,48 @@ STAR_SHAPE = [1, 2, 3, 4, 6, 8, 11, 12, 16, 22, 23, 32, 45, 46, 64, 90, 128]
 STAR_FILTER_SHAPE = [(1, 0), (3, 1), (4, 2), (5, 3), (7, 4), (8, 5),
                      (9, 6), (11, 8), (13, 10), (14, 11), (15, 12), (16, 14)]
 
-
-def _filter_image(image, min_scale, max_scale, mode):
-
-    response = np.zeros((image.shape[0], image.shape[1],
-                         max_scale - min_scale + 1), dtype=np.double)
+# Kernels at least this wide are applied in the frequency domain, where the
+# cost no longer grows with the kernel area. Octagons are otherwise filtered
+# with row-wise prefix sums at a cost linear in their width (see
+# `_octagon_filter`), so they only switch to the FFT at a larger size.
+FFT_KERNEL_SIZE = 11
+FFT_OCTAGON_SIZE = 17
+
+# Images with fewer pixels than this have their scales filtered serially.
+PARALLEL_MIN_SIZE = 256 * 256
+
+
+def _convolve(image, kernel, out):
+    # Equivalent to ``scipy.ndimage.convolve(image, kernel, out)`` for the odd,
+    # square bi-level kernels used here. The image is padded by reflection
+    # (``mode='reflect'`` in ndimage) before the FFT convolution so that the
+    # borders match the direct spatial convolution. This only holds while the
+    # kernel radius does not exceed the image size: beyond that, ndimage and
+    # ``np.pad(..., mode='symmetric')`` extend the image differently and the
+    # borders of the two results differ.
+    if kernel.shape[0] < FFT_KERNEL_SIZE:
+        convolve(image, kernel, output=out)
+    else:
+        r = kernel.shape[0] // 2
+        padded = np.pad(image, r, mode='symmetric')
+        out[:] = fftconvolve(padded, kernel, mode='valid')
+
+
+def _filter_image(image, min_scale, max_scale, mode, num_workers=None):
+
+    # Single precision images get a single precision response, which halves
+    # the memory traffic of all the subsequent passes over it. Store the
+    # scales one after the other so that every response[:, :, i] is a
+    # contiguous memory block.
+    dtype = np.float32 if image.dtype == np.float32 else np.double
+    response = np.zeros((max_scale - min_scale + 1, image.shape[0],
+                         image.shape[1]), dtype=dtype).transpose(1, 2, 0)
 
     if mode == 'dob':
 
-        # make response[:, :, i] contiguous memory block
-        item_size = response.itemsize
-        response.strides = (item_size * response.shape[1], item_size,
-                            item_size * response.shape[0] * response.shape[1])
+        integral_img = integral_image(image.astype(np.double, copy=False))
 
-        integral_img = integral_image(image)
-
-        for i in range(max_scale - min_scale + 1):
+        def filter_scale(i):
             n = min_scale + i
 
             # Constant multipliers for the outer region and the inner region
@@ -55,27 +87,116 @@ def _filter_image(image, min_scale, max_scale, mode):
     # NOTE : For the Octagon shaped filter, we implemented and evaluated the
     # slanted integral image based image filtering but the performance was
     # more or less equal to image filtering using
-    # scipy.ndimage.filters.convolve(). Hence we have decided to use the
-    # later for a much cleaner implementation.
+    # scipy.ndimage.filters.convolve(). Instead, every row of an octagon is
+    # a run of pixels whose sum takes two lookups in the row-wise cumulative
+    # sum of the image, which brings the cost per pixel down from O(k ** 2)
+    # to O(k) for a k x k filter. The largest filters are convolved using the
+    # FFT instead.
     elif mode == 'octagon':
         # TODO : Decide the shapes of Octagon filters for scales > 7
 
-        for i in range(max_scale - min_scale + 1):
-            mo, no = OCTAGON_OUTER_SHAPE[min_scale + i - 1]
-            mi, ni = OCTAGON_INNER_SHAPE[min_scale + i - 1]
-            response[:, :, i] = convolve(image,
-                                         _octagon_kernel(mo, no, mi, ni))
+        shapes = list(zip(OCTAGON_OUTER_SHAPE[min_scale - 1:max_scale],
+                          OCTAGON_INNER_SHAPE[min_scale - 1:max_scale]))
+
+        # The row-wise cumulative sum only depends on the image, so it is
+        # computed once, with enough padding for the largest octagon that is
+        # not convolved using the FFT.
+        pad = max([(mo + 2 * no) // 2 for (mo, no), _ in shapes
+                   if mo + 2 * no < FFT_OCTAGON_SIZE], default=0)
+        row_csum = _padded_row_cumsum(image, pad)
+
+        def filter_scale(i):
+            (mo, no), (mi, ni) = shapes[i]
+            if mo + 2 * no < FFT_OCTAGON_SIZE:
+                _octagon_filter(row_csum, pad, mo, no, mi, ni,
+                                response[:, :, i])
+            else:
+                _convolve(image, _octagon_kernel(mo, no, mi, ni),
+                          response[:, :, i])
 
     elif mode == 'star':
 
-        for i in range(max_scale - min_scale + 1):
+        def filter_scale(i):
             m = STAR_SHAPE[STAR_FILTER_SHAPE[min_scale + i - 1][0]]
             n = STAR_SHAPE[STAR_FILTER_SHAPE[min_scale + i - 1][1]]
-            response[:, :, i] = convolve(image, _star_kernel(m, n))
+            _convolve(image, _star_kernel(m, n), response[:, :, i])
+
+    # The scales are independent of each other and the DoB loop, as well as
+    # most of the NumPy and SciPy filtering, runs without the GIL, so the
+    # scales are filtered concurrently by up to `num_workers` threads. For
+    # small images, starting the threads costs more than the filtering
+    # itself.
+    num_scales = max_scale - min_scale + 1
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    max_workers = min(num_scales, num_workers)
+    if image.size < PARALLEL_MIN_SIZE or max_workers <= 1:
+        for i in range(num_scales):
+            filter_scale(i)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Exhaust the results to raise any exception of the workers.
+            list(executor.map(filter_scale, range(num_scales)))
 
     return response
 
 
+# The filter shapes and kernels only depend on the scale, so they are built
+# once and shared, read-only, by all the subsequent calls.
+@lru_cache(maxsize=None)
+def _octagon_half_widths(m, n):
+    # Each row of an octagon with odd sides is symmetric about the center
+    # pixel, so it spans `half_width` pixels on either side of it.
+    assert m % 2 == 1, 'octagon filters need an odd side length'
+    half_widths = octagon(m, n).sum(axis=1) // 2
+    half_widths.flags.writeable = False
+    return half_widths
+
+
+def _octagon_sum(row_csum, pad, shape, m, n):
+    # Sum of the pixels covered by ``octagon(m, n)`` centered on each pixel.
+    # `row_csum` is the cumulative sum along the rows of the image padded by
+    # `pad` pixels on each side, with a leading column of zeros, so that the
+    # sum of a padded row over the columns [a, b) is
+    # row_csum[row, b] - row_csum[row, a].
+    rows, cols = shape
+    half_widths = _octagon_half_widths(m, n)
+    r = half_widths.size // 2
+    total = np.zeros(shape, dtype=row_csum.dtype)
+    for dy, w in enumerate(half_widths, -r):
+        row = row_csum[pad + dy:pad + dy + rows]
+        total += row[:, pad + w + 1:pad + w + 1 + cols]
+        total -= row[:, pad - w:pad - w + cols]
+    return total
+
+
+def _padded_row_cumsum(image, pad):
+    # Cumulative sum along the rows of `image` padded by reflection, as
+    # expected by `_octagon_sum`.
+    padded = np.pad(image, pad, mode='symmetric')
+    row_csum = np.zeros((padded.shape[0], padded.shape[1] + 1),
+                        dtype=np.double)
+    np.cumsum(padded, axis=1, out=row_csum[:, 1:])
+    return row_csum
+
+
+def _octagon_filter(row_csum, pad, mo, no, mi, ni, out):
+    # Same as ``convolve(image, _octagon_kernel(mo, no, mi, ni), out)`` with
+    # ``row_csum = _padded_row_cumsum(image, pad)`` and
+    # ``pad >= (mo + 2 * no) // 2``.
+    outer = (mo + 2 * no) ** 2 - 2 * no * (no + 1)
+    inner = (mi + 2 * ni) ** 2 - 2 * ni * (ni + 1)
+    outer_weight = 1.0 / (outer - inner)
+    inner_weight = 1.0 / inner
+
+    outer_sum = _octagon_sum(row_csum, pad, out.shape, mo, no)
+    outer_sum *= outer_weight
+    inner_sum = _octagon_sum(row_csum, pad, out.shape, mi, ni)
+    inner_sum *= outer_weight + inner_weight
+    np.subtract(outer_sum, inner_sum, out=out)
+
+
+@lru_cache(maxsize=None)
 def _octagon_kernel(mo, no, mi, ni):
     outer = (mo + 2 * no) ** 2 - 2 * no * (no + 1)
     inner = (mi + 2 * ni) ** 2 - 2 * ni * (ni + 1)
@@ -87,9 +208,11 @@ def _octagon_kernel(mo, no, mi, ni):
     inner_oct[c: -c, c: -c] = octagon(mi, ni)
     bfilter = (outer_weight * outer_oct -
                (outer_weight + inner_weight) * inner_oct)
+    bfilter.flags.writeable = False
     return bfilter
 
 
+@lru_cache(maxsize=None)
 def _star_kernel(m, n):
     c = m + m // 2 - n - n // 2
     outer_star = star(m)
@@ -99,13 +222,55 @@ def _star_kernel(m, n):
     inner_weight = 1.0 / np.sum(inner_star)
     bfilter = (outer_weight * outer_star -
                (outer_weight + inner_weight) * inner_star)
+    bfilter.flags.writeable = False
     return bfilter
 
 
-def _suppress_lines(feature_mask, image, sigma, line_threshold):
-    Axx, Axy, Ayy = structure_tensor(image, sigma)
-    feature_mask[(Axx + Ayy) ** 2
-                 > line_threshold * (Axx * Ayy - Axy ** 2)] = False
+def _extrema_mask(response):
+    # Mask of the points of the inner scales of `response`, i.e.
+    # ``response[:, :, 1:-1]``, that are a minimum or a maximum of their
+    # 3 x 3 x 3 neighborhood. The minimum and maximum filters are separable:
+    # along the scale axis the inner scales never reach the border, so the
+    # three neighboring slices are compared directly, and the two spatial
+    # axes are filtered in 1D with the default 'reflect' mode.
+    center = response[:, :, 1:-1]
+    extrema = np.empty_like(center)
+    buffer = np.empty_like(center)
+    mask = np.zeros_like(center, dtype=bool)
+    for extremum, extremum_filter1d in ((np.minimum, minimum_filter1d),
+                                        (np.maximum, maximum_filter1d)):
+        extremum(response[:, :, :-2], center, out=extrema)
+        extremum(extrema, response[:, :, 2:], out=extrema)
+        extremum_filter1d(extrema, 3, axis=0, output=buffer)
+        extremum_filter1d(buffer, 3, axis=1, output=extrema)
+        mask |= extrema == center
+    return mask
+
+
+def _suppress_lines(feature_mask, image, sigmas, line_threshold):
+    # Only the Gaussian window of the structure tensor depends on the scale,
+    # so the derivatives and their products are computed once and smoothed
+    # with the sigma of each scale in `feature_mask[:, :, i]`.
+    imx, imy = _compute_derivatives(image)
+    products = (imx * imx, imx * imy, imy * imy)
+
+    # One set of (rows, cols) buffers is reused for every scale, so the
+    # memory needed does not grow with the number of scales.
+    Axx, Axy, Ayy, det = (np.empty_like(imx) for _ in range(4))
+    for i, sigma in enumerate(sigmas):
+        for product, A in zip(products, (Axx, Axy, Ayy)):
+            gaussian_filter(product, sigma, output=A, mode='constant')
+
+        # Evaluate
+        # ``(Axx + Ayy) ** 2 > line_threshold * (Axx * Ayy - Axy ** 2)``
+        # in place, with `det` as the only extra buffer.
+        np.multiply(Axx, Ayy, out=det)
+        np.square(Axy, out=Axy)
+        det -= Axy
+        det *= line_threshold
+        trace = np.add(Axx, Ayy, out=Axx)
+        np.square(trace, out=trace)
+        feature_mask[:, :, i][trace > det] = False
 
 
 class CENSURE(FeatureDetector):
@@ -135,6 +300,11 @@ class CENSURE(FeatureDetector):
     line_threshold : float, optional
         Threshold for rejecting interest points which have ratio of principal
         curvatures greater than this value.
+    num_workers : int or None, optional
+        The number of parallel threads used to filter the scales of images
+        with at least 256 * 256 pixels. If set to ``None``, the full set of
+        available cores are used. Set it to 1 to filter the scales serially,
+        e.g. when images are already processed in parallel.
 
     Attributes
     ----------
@@ -195,7 +365,8 @@ class CENSURE(FeatureDetector):
     """
 
     def __init__(self, min_scale=1, max_scale=7, mode='DoB',
-                 non_max_threshold=0.15, line_threshold=10):
+                 non_max_threshold=0.15, line_threshold=10,
+                 num_workers=None):
 
         mode = mode.lower()
         if mode not in ('dob', 'octagon', 'star'):
@@ -210,6 +381,7 @@ class CENSURE(FeatureDetector):
         self.mode = mode
         self.non_max_threshold = non_max_threshold
         self.line_threshold = line_threshold
+        self.num_workers = num_workers
 
         self.keypoints = None
         self.scales = None
@@ -230,8 +402,8 @@ class CENSURE(FeatureDetector):
         # (2) We then perform Non-Maximal suppression in 3 x 3 x 3 window on
         # the filter_response to suppress points that are neither minima or
         # maxima in 3 x 3 x 3 neighbourhood. We obtain a boolean ndarray
-        # `feature_mask` containing all the minimas and maximas in
-        # `filter_response` as True.
+        # `feature_mask` containing all the minimas and maximas in the inner
+        # scales of `filter_response` as True.
         # (3) Then we suppress all the points in the `feature_mask` for which
         # the corresponding point in the image at a particular scale has the
         # ratio of principal curvatures greater than `line_threshold`.
@@ -246,28 +418,26 @@ class CENSURE(FeatureDetector):
 
         # Generating all the scales
         filter_response = _filter_image(image, self.min_scale, self.max_scale,
-                                        self.mode)
+                                        self.mode, self.num_workers)
 
         # Suppressing points that are neither minima or maxima in their
-        # 3 x 3 x 3 neighborhood to zero
-        minimas = minimum_filter(filter_response, (3, 3, 3)) == filter_response
-        maximas = maximum_filter(filter_response, (3, 3, 3)) == filter_response
-
-        feature_mask = minimas | maximas
-        feature_mask[filter_response < self.non_max_threshold] = False
-
-        for i in range(1, num_scales):
-            # sigma = (window_size - 1) / 6.0, so the window covers > 99% of
-            #                                  the kernel's distribution
-            # window_size = 7 + 2 * (min_scale - 1 + i)
-            # Hence sigma = 1 + (min_scale - 1 + i)/ 3.0
-            _suppress_lines(feature_mask[:, :, i], image,
-                            (1 + (self.min_scale + i - 1) / 3.0),
-                            self.line_threshold)
-
-        rows, cols, scales = np.nonzero(feature_mask[..., 1:num_scales])
-        keypoints = np.column_stack([rows, cols])
-        scales = scales + self.min_scale + 1
+        # 3 x 3 x 3 neighborhood to zero. Only the scales in the range
+        # [min_scale + 1, max_scale - 1] are kept in `feature_mask`.
+        feature_mask = _extrema_mask(filter_response)
+        feature_mask &= (filter_response[:, :, 1:num_scales]
+                         >= self.non_max_threshold)
+
+        # sigma = (window_size - 1) / 6.0, so the window covers > 99% of
+        #                                  the kernel's distribution
+        # window_size = 7 + 2 * (min_scale - 1 + i)
+        # Hence sigma = 1 + (min_scale - 1 + i)/ 3.0
+        sigmas = [1 + (self.min_scale + i - 1) / 3.0
+                  for i in range(1, num_scales)]
+        _suppress_lines(feature_mask, image, sigmas, self.line_threshold)
+
+        coords = np.argwhere(feature_mask)
+        keypoints = np.ascontiguousarray(coords[:, :2])
+        scales = coords[:, 2] + (self.min_scale + 1)
 
         if self.mode == 'dob':
             self.keypoints = keypoints
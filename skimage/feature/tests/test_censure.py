@@ -1,7 +1,9 @@
 import numpy as np
-from skimage._shared.testing import assert_array_equal
+from scipy import ndimage as ndi
+from skimage._shared.testing import assert_array_equal, assert_allclose
 from skimage.data import moon
 from skimage.feature import CENSURE
+from skimage.feature import censure
 from skimage._shared.testing import test_parallel
 from skimage._shared import testing
 from skimage.transform import rescale
@@ -19,6 +21,69 @@ def test_censure_on_rectangular_images():
     CENSURE().detect((rect_image))
 
 
+@testing.parametrize('mode', ['dob', 'octagon', 'star'])
+def test_censure_on_float32_images(mode):
+    """Censure feature detector should work on single precision images, in
+    single precision, with the same results as in double precision."""
+    image = rescale(img, 0.25, multichannel=False, anti_aliasing=False,
+                    mode='constant').astype(np.float32)
+
+    response = censure._filter_image(image, 1, 7, mode)
+    assert response.dtype == np.float32
+
+    detector32 = CENSURE(mode=mode)
+    detector32.detect(image)
+    detector64 = CENSURE(mode=mode)
+    detector64.detect(image.astype(np.float64))
+    assert_array_equal(detector64.keypoints, detector32.keypoints)
+    assert_array_equal(detector64.scales, detector32.scales)
+
+
+@testing.parametrize('min_scale, max_scale', [(1, 7), (3, 11)])
+def test_octagon_filter_matches_convolve(min_scale, max_scale):
+    """The octagon filter should equal a dense convolution for all scales."""
+    image = np.random.rand(80, 90)
+    response = censure._filter_image(image, min_scale, max_scale, 'octagon',
+                                     num_workers=1)
+    expected = np.dstack([
+        ndi.convolve(image, censure._octagon_kernel(*outer + inner))
+        for outer, inner in zip(
+            censure.OCTAGON_OUTER_SHAPE[min_scale - 1:max_scale],
+            censure.OCTAGON_INNER_SHAPE[min_scale - 1:max_scale])])
+    assert_allclose(response, expected, atol=1e-10)
+
+
+@testing.parametrize('mode', ['octagon', 'star'])
+def test_fft_convolve_matches_convolve(mode):
+    """Large bi-level kernels applied with the FFT should equal a dense
+    convolution."""
+    image = np.random.rand(80, 90)
+    if mode == 'octagon':
+        kernels = [censure._octagon_kernel(*outer + inner)
+                   for outer, inner in zip(censure.OCTAGON_OUTER_SHAPE,
+                                           censure.OCTAGON_INNER_SHAPE)]
+    else:
+        kernels = [censure._star_kernel(censure.STAR_SHAPE[m],
+                                        censure.STAR_SHAPE[n])
+                   for m, n in censure.STAR_FILTER_SHAPE[:7]]
+    kernels = [k for k in kernels if k.shape[0] >= censure.FFT_KERNEL_SIZE]
+    assert kernels
+    for kernel in kernels:
+        out = np.empty_like(image)
+        censure._convolve(image, kernel, out)
+        assert_allclose(out, ndi.convolve(image, kernel), atol=1e-10)
+
+
+@testing.parametrize('mode', ['dob', 'octagon', 'star'])
+def test_censure_threaded_scales(monkeypatch, mode):
+    """Filtering the scales in threads should not change the response."""
+    monkeypatch.setattr(censure, 'PARALLEL_MIN_SIZE', 0)
+    image = np.random.rand(100, 120)
+    serial = censure._filter_image(image, 1, 7, mode, num_workers=1)
+    threaded = censure._filter_image(image, 1, 7, mode, num_workers=4)
+    assert_array_equal(serial, threaded)
+
+
 def test_keypoints_censure_color_image_unsupported_error():
     """Censure keypoints can be extracted from gray-scale images only."""
     with testing.raises(ValueError):
@@ -276,18 +276,15 @@ def octagon(m, n, dtype=np.uint8):
         are 1 and 0 otherwise.
 
     """
-    from . import convex_hull_image
-    selem = np.zeros((m + 2 * n, m + 2 * n))
-    selem[0, n] = 1
-    selem[n, 0] = 1
-    selem[0, m + n - 1] = 1
-    selem[m + n - 1, 0] = 1
-    selem[-1, n] = 1
-    selem[n, -1] = 1
-    selem[-1, m + n - 1] = 1
-    selem[m + n - 1, -1] = 1
-    selem = convex_hull_image(selem).astype(dtype)
-    return selem
+    # The octagon is the square of side m + 2 * n with its four corner
+    # triangles of n * (n + 1) / 2 pixels cut off, i.e. the pixels within an
+    # L1 distance of m + n - 1 from the center. Without horizontal and
+    # vertical sides (m == 0), the diamond within an L1 distance of n remains.
+    size = m + 2 * n
+    c = (size - 1) / 2
+    Y, X = np.ogrid[:size, :size]
+    selem = np.abs(Y - c) + np.abs(X - c) <= max(m, 1) + n - 1
+    return selem.astype(dtype)
 
 
 def star(a, dtype=np.uint8):
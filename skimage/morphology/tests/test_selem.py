@@ -100,8 +100,26 @@ class TestSElem():
                                    [1, 1, 1],
                                    [0, 1, 0]], dtype=np.uint8)
         actual_mask2 = selem.octagon(1, 1)
+        expected_mask3 = np.array([[0, 0, 1, 1, 1, 1, 0, 0],
+                                   [0, 1, 1, 1, 1, 1, 1, 0],
+                                   [1, 1, 1, 1, 1, 1, 1, 1],
+                                   [1, 1, 1, 1, 1, 1, 1, 1],
+                                   [1, 1, 1, 1, 1, 1, 1, 1],
+                                   [1, 1, 1, 1, 1, 1, 1, 1],
+                                   [0, 1, 1, 1, 1, 1, 1, 0],
+                                   [0, 0, 1, 1, 1, 1, 0, 0]], dtype=np.uint8)
+        actual_mask3 = selem.octagon(4, 2)
+        expected_mask4 = np.array([[0, 0, 1, 1, 0, 0],
+                                   [0, 1, 1, 1, 1, 0],
+                                   [1, 1, 1, 1, 1, 1],
+                                   [1, 1, 1, 1, 1, 1],
+                                   [0, 1, 1, 1, 1, 0],
+                                   [0, 0, 1, 1, 0, 0]], dtype=np.uint8)
+        actual_mask4 = selem.octagon(0, 3)
         assert_equal(expected_mask1, actual_mask1)
         assert_equal(expected_mask2, actual_mask2)
+        assert_equal(expected_mask3, actual_mask3)
+        assert_equal(expected_mask4, actual_mask4)
 
     def test_selem_ellipse(self):
         """Test ellipse structuring elements"""
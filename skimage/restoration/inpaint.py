@@ -61,14 +61,14 @@ def _inpaint_biharmonic_single_channel(mask, out, limits):
     matrix_unknown = sparse.csr_matrix(matrix_unknown)
     result = spsolve(matrix_unknown, rhs)
 
-    # Handle enormous values
-    result = np.clip(result, *limits)
-
     result = result.ravel()
 
-    # Substitute masked points with inpainted versions
-    for mask_pt_n, mask_pt_idx in enumerate(mask_pts):
-        out[tuple(mask_pt_idx)] = result[mask_pt_n]
+    # Handle enormous values
+    np.clip(result, *limits, out=result)
+
+    # Substitute masked points with inpainted versions, `result` follows the
+    # C order of `mask_pts`, i.e. of `np.where(mask)`
+    out[mask] = result
 
     return out
 